@@ -489,6 +489,7 @@ def package_toolchain(toolchain_builder: LLVMBuilder,
     lib_dir = install_dir / 'lib'
     strip_cmd = Builder.toolchain.strip
 
+    strip_cmds = []
     for binary in bin_dir.iterdir():
         if binary.is_file():
             if binary.name not in necessary_bin_files:
@@ -501,9 +502,10 @@ def package_toolchain(toolchain_builder: LLVMBuilder,
                     # These specific flags prevent Darwin executables from being
                     # stripped of additional global symbols that might be used
                     # by plugins.
-                    utils.check_call([strip_cmd, '-S', '-x', binary])
+                    strip_cmds.append([strip_cmd, '-S', '-x', binary])
                 else:
-                    utils.check_call([strip_cmd, binary])
+                    strip_cmds.append([strip_cmd, binary])
+    utils.check_call_parallel(strip_cmds)
 
     # FIXME: check that all libs under lib/clang/<version>/ are created.
     for necessary_bin_file in necessary_bin_files:
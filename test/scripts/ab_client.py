@@ -19,7 +19,9 @@
 
 try:
     import apiclient.discovery
+    import apiclient.errors
     import apiclient.http
+    import httplib2
     from oauth2client import client as oauth2_client
 except ImportError:
     missingImportString = """
@@ -30,12 +32,19 @@ except ImportError:
 """
     raise ImportError(missingImportString)
 
-from typing import Tuple, List
+from typing import Any, Dict, Optional, Tuple, List
+import concurrent.futures
 import getpass
 import io
 import logging
+import os
+import sys
+import tempfile
+import threading
+import time
 
 from data import WorkNodeRecord, TestResultRecord
+import test_paths
 import utils
 
 ANDROID_BUILD_API_SCOPE = (
@@ -43,6 +52,22 @@ ANDROID_BUILD_API_SCOPE = (
 ANDROID_BUILD_API_NAME = 'androidbuildinternal'
 ANDROID_BUILD_API_VERSION = 'v3'
 CHUNK_SIZE = 10 * 1024 * 1024  # 10M
+MAX_BATCH_SIZE = 50
+MAX_BATCH_WORKERS = 8
+# Partial response mask for worknode().list(): only the fields read by
+# _parse_worknodes().
+WORKNODE_FIELDS = (
+    'workNodes(id,isFinal,workExecutorType,status,'
+    'workOutput(success,displayMessage,buildOutput/buildId,'
+    'testOutput(buildId,antsInvocationId)),'
+    'workParameters(submitQueue(branch,target,buildIds),'
+    'atpTestParameters(branch,target,testName)))')
+BUILD_FIELDS = 'branch,buildAttemptStatus,successful'
+
+DISCOVERY_CACHE = (test_paths.CACHE_DIR /
+                   f'discovery-{ANDROID_BUILD_API_NAME}-'
+                   f'{ANDROID_BUILD_API_VERSION}.json')
+DISCOVERY_CACHE_SECONDS = 24 * 60 * 60
 
 
 STUBBY_COMMAND_PATH = '/google/data/ro/teams/android-llvm/tests/sso_stubby_cmd.sh'
@@ -71,19 +96,57 @@ def _get_oauth2_token():
     return output.split('"')[1]
 
 
+def _get_discovery_document() -> str:
+    """Return the build API discovery document, cached for a day."""
+    try:
+        if (DISCOVERY_CACHE.stat().st_mtime >
+                time.time() - DISCOVERY_CACHE_SECONDS):
+            return DISCOVERY_CACHE.read_text()
+    except FileNotFoundError:
+        pass
+
+    uri = apiclient.discovery.DISCOVERY_URI.format(
+        api=ANDROID_BUILD_API_NAME, apiVersion=ANDROID_BUILD_API_VERSION)
+    resp, content = httplib2.Http().request(uri)
+    if resp.status >= 400:
+        raise apiclient.errors.HttpError(resp, content, uri=uri)
+    document = content.decode('utf-8')
+
+    try:
+        DISCOVERY_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w',
+                                         dir=DISCOVERY_CACHE.parent,
+                                         delete=False) as tmp:
+            tmp.write(document)
+        os.replace(tmp.name, DISCOVERY_CACHE)
+    except OSError as e:
+        logging.warning(f'Unable to cache discovery document: {e}')
+    return document
+
+
 class AndroidBuildClient():
     """Helper class to query the Android build API."""
 
     def __init__(self):
-        creds = oauth2_client.AccessTokenCredentials(
+        self.creds = oauth2_client.AccessTokenCredentials(
                 access_token=_get_oauth2_token(), user_agent='unused/1.0')
 
-        self.client = apiclient.discovery.build(
-            ANDROID_BUILD_API_NAME,
-            ANDROID_BUILD_API_VERSION,
-            credentials=creds,
-            discoveryServiceUrl=apiclient.discovery.DISCOVERY_URI,
-            cache_discovery=False)
+        self.client = apiclient.discovery.build_from_document(
+            _get_discovery_document(), credentials=self.creds)
+        self._local = threading.local()
+
+    def _thread_http(self):
+        """Return an authorized httplib2.Http for the calling thread.
+
+        httplib2.Http objects are not thread-safe, so each thread gets its
+        own.  It is reused for later requests on that thread, which keeps the
+        connection to the build API alive across batches.
+        """
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self.creds.authorize(httplib2.Http())
+            self._local.http = http
+        return http
 
     @staticmethod
     def _worknode_parse_general(workNodeData):
@@ -100,10 +163,59 @@ class AndroidBuildClient():
     def get_worknode_status(self, forrest_invocation_id: str,
                             tag: str) -> Tuple[bool, List[TestResultRecord]]:
         """Return completion status and results from a Forrest invocation."""
-        resultStr = lambda res: 'passed' if res else 'failed'
-
-        request = self.client.worknode().list(workPlanId=forrest_invocation_id)
+        request = self.client.worknode().list(workPlanId=forrest_invocation_id,
+                                              fields=WORKNODE_FIELDS)
         response = request.execute()
+        return AndroidBuildClient._parse_worknodes(response, tag)
+
+    def get_worknode_statuses(
+        self, invocations: List[Tuple[str, str]]
+    ) -> Dict[str, Tuple[bool, List[TestResultRecord]]]:
+        """Return completion status and results for several Forrest invocations.
+
+        `invocations` is a list of (forrest_invocation_id, tag) pairs.  The
+        queries are grouped into HTTP batch requests of up to MAX_BATCH_SIZE
+        and the batches are sent to the build API concurrently.
+        """
+        batches = [
+            invocations[i:i + MAX_BATCH_SIZE]
+            for i in range(0, len(invocations), MAX_BATCH_SIZE)
+        ]
+        responses = {}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=MAX_BATCH_WORKERS) as executor:
+            for result in executor.map(self._execute_worknode_batch, batches):
+                responses.update(result)
+
+        return {
+            inv: AndroidBuildClient._parse_worknodes(responses[inv], tag)
+            for inv, tag in invocations
+        }
+
+    def _execute_worknode_batch(self, invocations: List[Tuple[str, str]]):
+        responses = {}
+        errors = []
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            else:
+                responses[request_id] = response
+
+        batch = self.client.new_batch_http_request(callback=callback)
+        for inv, _ in invocations:
+            batch.add(self.client.worknode().list(workPlanId=inv,
+                                                  fields=WORKNODE_FIELDS),
+                      request_id=inv)
+        batch.execute(http=self._thread_http())
+        if errors:
+            raise errors[0]
+        return responses
+
+    @staticmethod
+    def _parse_worknodes(response,
+                         tag: str) -> Tuple[bool, List[TestResultRecord]]:
+        resultStr = lambda res: 'passed' if res else 'failed'
 
         results = []
         workDone = False
@@ -154,13 +266,15 @@ class AndroidBuildClient():
                         build_id = workOutput['testOutput']['buildId']
                         ants_id = workOutput['testOutput']['antsInvocationId']
                     display_message = workOutput.get('displayMessage', 'NA')
-                test_name = params['testName']
+                test_name = sys.intern(params['testName'])
             else:
                 raise RuntimeError(f'Unexpected workExecutorType {msg} with ' +
                                    f'worknode data:\n{worknode}')
 
-            branch = params['branch']
-            target = params['target']
+            # Branches, targets and test names repeat across worknodes and
+            # invocations, so keep a single copy of each.
+            branch = sys.intern(params['branch'])
+            target = sys.intern(params['target'])
 
             results.append(
                 TestResultRecord(
@@ -177,6 +291,16 @@ class AndroidBuildClient():
 
         return workDone, results
 
+    def get_build(self, buildId: str, target: str) -> Optional[Dict[str, Any]]:
+        """Return branch and completion status of a build."""
+        request = self.client.build().get(
+            buildId=buildId, target=target, fields=BUILD_FIELDS)
+        try:
+            return request.execute()
+        except apiclient.errors.HttpError as e:
+            logging.error(f'Build query failed for {buildId}:{target}: {e}')
+            return None
+
     def get_artifact(self, buildId: str, target: str, resource: str) -> bytes:
         """Download an artifact from the buildbot."""
         request = self.client.buildartifact().get_media(
@@ -16,9 +16,12 @@
 # pylint: disable=invalid-name
 """Manage test metadata stored in CSV files"""
 
-from typing import Callable, Generic, List, Optional, NamedTuple, TypeVar, Iterable
+from typing import (Callable, Dict, Generic, Iterable, KeysView, List,
+                    NamedTuple, Optional, Sequence, TextIO, Tuple, TypeVar)
+import concurrent.futures
+import contextlib
 import csv
-import io
+import itertools
 import logging
 import subprocess
 
@@ -34,12 +37,31 @@ def _read_cns_file(filename: str) -> str:
     return utils.check_output(FILEUTIL_CMD_PREFIX + ['cat', filename])
 
 
-def _write_cns_file(filename: str, contents: str) -> None:
-    """Write to CNS using `fileutil cp /dev/stdin <filename>`."""
-    utils.check_call(
-        FILEUTIL_CMD_PREFIX + ['cp', '-f', '/dev/stdin', filename],
-        input=contents,
-        stderr=subprocess.DEVNULL)
+def _write_cns_file(filename: str, write_fn: Callable[[TextIO], None]) -> None:
+    """Write to CNS using `fileutil cp /dev/stdin <filename>`.
+
+    write_fn is called with a text stream connected to fileutil's stdin, so the
+    contents are streamed to CNS without first building them in memory.
+    """
+    cmd = FILEUTIL_CMD_PREFIX + ['cp', '-f', '/dev/stdin', filename]
+    utils.log_subprocess(cmd, 'subprocess.Popen')
+    broken_pipe = None
+    with subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True) as proc:
+        try:
+            write_fn(proc.stdin)
+            proc.stdin.close()
+        except BrokenPipeError as e:
+            # fileutil exited before reading everything.  Its exit status,
+            # checked once it has been waited for, says why.
+            broken_pipe = e
+            with contextlib.suppress(BrokenPipeError):
+                proc.stdin.close()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd) from broken_pipe
+    if broken_pipe:
+        raise broken_pipe
 
 
 class PrebuiltCLRecord(NamedTuple):
@@ -96,51 +118,149 @@ class CSVTable(Generic[RecordType]):
 
     makeRow: Callable[[Iterable[str]], RecordType]
 
-    def __init__(self, csvfile):
+    # Column tuples for which a lookup index is maintained.  Use lookup() to
+    # query records by these columns instead of scanning with get().
+    indexKeys: Tuple[Tuple[str, ...], ...] = ()
+
+    def __init__(self, csvfile: str, file_contents: str):
+        """Create a table for csvfile from its already-read file_contents.
+
+        Use fromCNS() to read csvfile from CNS.
+        """
         self.csvfile: str = csvfile
-        self.records: List[RecordType] = []
-        file_contents = _read_cns_file(self.csvfile)
-        reader = csv.reader(file_contents.splitlines())
+        # Records are kept in insertion order keyed by a row id, so that a
+        # record can be deleted without scanning or shifting the other rows.
+        self._rows: Dict[int, RecordType] = {}
+        self._rowIds: Dict[RecordType, List[int]] = {}
+        self._nextRowId = itertools.count()
+        self._batchDepth: int = 0
+        self._dirty: bool = False
+        self._indexes: Dict[Tuple[str, ...], Dict[Tuple[str, ...],
+                                                  List[RecordType]]]
+        self._indexes = {key: {} for key in self.indexKeys}
+        if '"' in file_contents or '\r' in file_contents:
+            reader = csv.reader(file_contents.splitlines())
+        else:
+            # No quoted fields, so every line is a plain comma-separated row.
+            reader = (line.split(',') for line in file_contents.split('\n')
+                      if line)
         self.header = next(reader)
+        # Columns like branch, target and tag repeat across many rows.  Share
+        # one string object per distinct value.
+        pool: Dict[str, str] = {}
         for row in reader:
-            self.records.append(self.makeRow(row))
+            self._append(self.makeRow(pool.setdefault(c, c) for c in row))
+
+    @classmethod
+    def fromCNS(cls, csvfile: str):
+        """Read csvfile from CNS and create a table from its contents."""
+        return cls(csvfile, _read_cns_file(csvfile))
+
+    @property
+    def records(self) -> List[RecordType]:
+        """Return all records in the table."""
+        return list(self._rows.values())
+
+    def __contains__(self, record: RecordType) -> bool:
+        """Return whether record is in the table, using a hash lookup."""
+        return record in self._rowIds
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _append(self, record: RecordType) -> None:
+        rowId = next(self._nextRowId)
+        self._rows[rowId] = record
+        self._rowIds.setdefault(record, []).append(rowId)
+        self._indexRecord(record)
+
+    def _indexRecord(self, record: RecordType) -> None:
+        for key, index in self._indexes.items():
+            value = tuple(getattr(record, column) for column in key)
+            index.setdefault(value, []).append(record)
+
+    def _unindexRecord(self, record: RecordType) -> None:
+        for key, index in self._indexes.items():
+            value = tuple(getattr(record, column) for column in key)
+            matches = index[value]
+            matches.remove(record)
+            if not matches:
+                del index[value]
+
+    def __enter__(self):
+        """Defer writes to CNS until the end of a `with` block.
+
+        Mutations inside the block are written back with a single write() on
+        exit, and only if some record was added or removed.  If the block
+        raises, nothing is written, so CNS never sees a half-applied update;
+        the in-memory table keeps the mutations.
+        """
+        if self._batchDepth == 0:
+            self._dirty = False
+        self._batchDepth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._batchDepth -= 1
+        if self._batchDepth == 0 and self._dirty:
+            if exc_type is not None:
+                logging.warning(f'Not writing {self.csvfile} to CNS after '
+                                f'{exc_type.__name__} in batched update')
+                self._dirty = False
+                return
+            self.write()
+
+    def _writeBack(self) -> None:
+        if self._batchDepth:
+            self._dirty = True
+        else:
+            self.write()
 
     def add(self, record: RecordType, writeBack: bool = True) -> None:
         """Add a record and optionally write immediately to CNS.
 
         writeBack: CSV file in CNS is updated if this parameter is True.  Set to
         False if updates are batched for a writeback at the end.  NOTE: Data is
-        written only if CSVTable.write() is called.
+        written only if CSVTable.write() is called.  Inside a `with table:`
+        block, the write is deferred to the end of the block.
         """
-        self.records.append(record)
+        self._append(record)
         if writeBack:
-            self.write()
+            self._writeBack()
 
     def remove(self, record: RecordType, writeBack: bool = True) -> None:
         """Remove a record and optionally write immediately to CNS.
 
         writeBack: CSV file in CNS is updated if this parameter is True.  Set to
         False if updates are batched for a writeback at the end.  NOTE: Data is
-        written only if CSVTable.write() is called.
+        written only if CSVTable.write() is called.  Inside a `with table:`
+        block, the write is deferred to the end of the block.
         """
-        if record not in self.records:
+        if record not in self:
             raise RuntimeError(f'Cannot remove non-existent record {record}')
-        self.records.remove(record)
+        rowIds = self._rowIds[record]
+        # Remove the first matching row, like list.remove().
+        del self._rows[rowIds.pop(0)]
+        if not rowIds:
+            del self._rowIds[record]
+        self._unindexRecord(record)
         if writeBack:
-            self.write()
+            self._writeBack()
 
     def write(self) -> None:
         """Write records back to CSV file."""
-        output = io.StringIO()
-        writer = csv.writer(output, lineterminator='\n')
-        writer.writerow(self.header)
-        writer.writerows(self.records)
+        self._dirty = False
+
+        def write_fn(output: TextIO) -> None:
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerow(self.header)
+            writer.writerows(self._rows.values())
 
-        _write_cns_file(self.csvfile, output.getvalue())
+        _write_cns_file(self.csvfile, write_fn)
 
     def get(self, filter_fn: Callable[[RecordType], bool]) -> List[RecordType]:
         """Return records that match a filter."""
-        return [r for r in self.records if filter_fn(r)]
+        return [r for r in self._rows.values() if filter_fn(r)]
 
     def getOne(self, filter_fn: Callable[[RecordType],
                                          bool]) -> Optional[RecordType]:
@@ -148,7 +268,32 @@ class CSVTable(Generic[RecordType]):
 
         Raise an exception if there's more than one match.
         """
-        records = self.get(filter_fn)
+        return self._unique(self.get(filter_fn))
+
+    def lookup(self, key: Tuple[str, ...], *values: str) -> List[RecordType]:
+        """Return records whose columns in key equal values.
+
+        key must be one of the table's indexKeys.
+        """
+        return list(self._indexes[key].get(values, ()))
+
+    def indexValues(self, key: Tuple[str, ...]) -> KeysView[Tuple[str, ...]]:
+        """Return the distinct values of the columns in key.
+
+        key must be one of the table's indexKeys.
+        """
+        return self._indexes[key].keys()
+
+    def lookupOne(self, key: Tuple[str, ...],
+                  *values: str) -> Optional[RecordType]:
+        """Return zero or one record whose columns in key equal values.
+
+        Raise an exception if there's more than one match.
+        """
+        return self._unique(self._indexes[key].get(values, ()))
+
+    @staticmethod
+    def _unique(records: Sequence[RecordType]) -> Optional[RecordType]:
         if len(records) == 0:
             return None
         if len(records) > 1:
@@ -160,6 +305,7 @@ class PrebuiltsTable(CSVTable[PrebuiltCLRecord]):
     """CSV table for bookkeeping prebuilt CLs."""
 
     makeRow = PrebuiltCLRecord._make
+    indexKeys = (('build_number',),)
 
     @staticmethod
     def buildNumberCompareFn(
@@ -167,9 +313,13 @@ class PrebuiltsTable(CSVTable[PrebuiltCLRecord]):
         """Return a lambda comparing build_number of a PrebuiltCLRecord."""
         return lambda that: that.build_number == build_number
 
+    def getByBuildNumber(self, build_number: str) -> List[PrebuiltCLRecord]:
+        """Return PrebuiltCL records with build_number."""
+        return self.lookup(('build_number',), build_number)
+
     def addPrebuilt(self, record: PrebuiltCLRecord) -> None:
         """Add a PrebuiltCL record and write back to CSV file."""
-        if self.get(self.buildNumberCompareFn(record.build_number)):
+        if self.getByBuildNumber(record.build_number):
             raise RuntimeError(f'Build {record.build_number} already exists')
         self.add(record)
 
@@ -180,7 +330,7 @@ class PrebuiltsTable(CSVTable[PrebuiltCLRecord]):
         If optional parameter cl_number is provided, raise an exception if the
         record's cl_number is different.
         """
-        row = self.getOne(self.buildNumberCompareFn(build_number))
+        row = self.lookupOne(('build_number',), build_number)
         if row and cl_number and row.cl_number != cl_number:
             raise RuntimeError(
                 f'CL mismatch for build {build_number}. ' +
@@ -191,6 +341,7 @@ class PrebuiltsTable(CSVTable[PrebuiltCLRecord]):
 class SoongCLTable(CSVTable[SoongCLRecord]):
     """CSV table for bookkeeping build/soong switchover CLs."""
     makeRow = SoongCLRecord._make
+    indexKeys = (('revision', 'version'),)
 
     @staticmethod
     def clangInfoCompareFn(revision,
@@ -201,8 +352,8 @@ class SoongCLTable(CSVTable[SoongCLRecord]):
 
     def addCL(self, record: SoongCLRecord) -> None:
         """Add a CL record and write back to CSV file."""
-        filterFn = self.clangInfoCompareFn(record.revision, record.version)
-        if self.get(filterFn):
+        if self.lookup(('revision', 'version'), record.revision,
+                       record.version):
             raise RuntimeError(f'Soong CL for {record} already exists')
         self.add(record)
 
@@ -213,7 +364,7 @@ class SoongCLTable(CSVTable[SoongCLRecord]):
         If optional parameter cl_number is provided, raise an exception if the
         record's cl_number is different.
         """
-        row = self.getOne(self.clangInfoCompareFn(revision, version))
+        row = self.lookupOne(('revision', 'version'), revision, version)
         if row and cl_number and cl_number != row.cl_number:
             raise RuntimeError(
                 f'CL mismatch for clang {revision} {version}. ' +
@@ -224,10 +375,11 @@ class SoongCLTable(CSVTable[SoongCLRecord]):
 class KernelCLTable(CSVTable[KernelCLRecord]):
     """CSV table for bookkeeping kernel/common switchover CLs."""
     makeRow = KernelCLRecord._make
+    indexKeys = (('revision',),)
 
     def addCL(self, record: KernelCLRecord) -> None:
         """Add a CL record and write back to CSV file."""
-        if self.get(lambda that: that.revision == record.revision):
+        if self.lookup(('revision',), record.revision):
             raise RuntimeError(f'Kernel CL for {record} already exists')
         self.add(record)
 
@@ -238,7 +390,7 @@ class KernelCLTable(CSVTable[KernelCLRecord]):
         If optional parameter cl_number is provided, raise an exception if the
         record's cl_number is different.
         """
-        row = self.getOne(lambda that: that.revision == revision)
+        row = self.lookupOne(('revision',), revision)
         if row and cl_number and cl_number != row.cl_number:
             raise RuntimeError(
                 f'CL mismatch for clang {revision}. ' +
@@ -249,34 +401,35 @@ class KernelCLTable(CSVTable[KernelCLRecord]):
 class WorkNodeTable(CSVTable[WorkNodeRecord]):
     """CSV table for Forrest worknode invocations (pending and completed)."""
     makeRow = WorkNodeRecord._make
+    indexKeys = (('invocation_id',),
+                 ('prebuilt_build_number', 'tag', 'branch', 'target'))
 
     def addInvocation(self, record: WorkNodeRecord, writeBack=True) -> None:
         """Add invocation to CSV Table and optionally write back."""
-        if self.get(lambda that: that.invocation_id == record.invocation_id):
+        if self.lookup(('invocation_id',), record.invocation_id):
             raise RuntimeError(f'Invocation {record} already exists')
         self.add(record, writeBack)
 
     def find(self, prebuilt_build_number, tag, branch,
              target) -> Optional[WorkNodeRecord]:
         """Find Forrest invocation based on (prebuilt, tag, branch, target)."""
-        return self.getOne(lambda that:
-            that.prebuilt_build_number == prebuilt_build_number and \
-            that.branch == branch and \
-            that.target == target and \
-            that.tag == tag)
+        return self.lookupOne(
+            ('prebuilt_build_number', 'tag', 'branch', 'target'),
+            prebuilt_build_number, tag, branch, target)
 
     def findByInvocation(self, invocation_id) -> Optional[WorkNodeRecord]:
         """Find Forrest invocation based on invocation_id."""
-        return self.getOne(lambda that: that.invocation_id == invocation_id)
+        return self.lookupOne(('invocation_id',), invocation_id)
 
 
 class TestResultsTable(CSVTable[TestResultRecord]):
     """CSV table for Forrest work records (for both builds and tests)."""
     makeRow = TestResultRecord._make
+    indexKeys = (('worknode_id',),)
 
     def addResult(self, record: TestResultRecord, writeBack=True) -> None:
         """Add test record and optionally write back."""
-        if recs := self.get(lambda that: that.worknode_id == record.worknode_id):
+        if recs := self.lookup(('worknode_id',), record.worknode_id):
             for rec in recs:
                 self.remove(rec, writeBack)
                 print(f'Removing record {record}.  Probably a retry')
@@ -299,16 +452,43 @@ class CNSData():
 
     @staticmethod
     def loadCNSData() -> None:
-        """Load CSV data from CNS."""
+        """Load CSV data from CNS.
+
+        The CSV files are read from CNS concurrently.
+        """
         cns_path = test_paths.cns_path()
         logging.info('Reading CNS data')
-        CNSData.Prebuilts = PrebuiltsTable(
-            f'{cns_path}/{test_paths.PREBUILT_CSV}')
-        CNSData.SoongCLs = SoongCLTable(f'{cns_path}/{test_paths.SOONG_CSV}')
-        CNSData.KernelCLs = KernelCLTable(f'{cns_path}/{test_paths.KERNEL_CSV}')
-        CNSData.PendingWorkNodes = WorkNodeTable(
-            f'{cns_path}/{test_paths.FORREST_PENDING_CSV}')
-        CNSData.CompletedWorkNodes = WorkNodeTable(
-            f'{cns_path}/{test_paths.FORREST_CSV}')
-        CNSData.TestResults = TestResultsTable(
-            f'{cns_path}/{test_paths.TEST_RESULTS_CSV}')
+        tables = {
+            'Prebuilts': (PrebuiltsTable, test_paths.PREBUILT_CSV),
+            'SoongCLs': (SoongCLTable, test_paths.SOONG_CSV),
+            'KernelCLs': (KernelCLTable, test_paths.KERNEL_CSV),
+            'PendingWorkNodes': (WorkNodeTable,
+                                 test_paths.FORREST_PENDING_CSV),
+            'CompletedWorkNodes': (WorkNodeTable, test_paths.FORREST_CSV),
+            'TestResults': (TestResultsTable, test_paths.TEST_RESULTS_CSV),
+        }
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(tables)) as executor:
+            contents = {
+                name: executor.submit(_read_cns_file, f'{cns_path}/{csv_name}')
+                for name, (_, csv_name) in tables.items()
+            }
+        for name, (table_cls, csv_name) in tables.items():
+            setattr(
+                CNSData, name,
+                table_cls(f'{cns_path}/{csv_name}', contents[name].result()))
+
+    @staticmethod
+    @contextlib.contextmanager
+    def batch():
+        """Batch writes to all tables until the end of a `with` block.
+
+        Each modified table is written back to CNS exactly once on exit, or not
+        at all if the block raises.
+        """
+        with contextlib.ExitStack() as stack:
+            for table in (CNSData.Prebuilts, CNSData.SoongCLs,
+                          CNSData.KernelCLs, CNSData.PendingWorkNodes,
+                          CNSData.CompletedWorkNodes, CNSData.TestResults):
+                stack.enter_context(table)
+            yield
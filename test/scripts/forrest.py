@@ -16,7 +16,7 @@
 # pylint: disable=invalid-name
 """Script to submit builds/tests in Forrest."""
 
-from typing import Dict, List, NamedTuple
+from typing import Dict, NamedTuple, Sequence
 import re
 import yaml
 
@@ -122,8 +122,8 @@ def _get_device_info(target: str) -> ClusterRecord:
             f'Cannot find cluster info for {orig} (normalized to {target})')
 
 
-def invokeForrestRun(branch: str, target: str, cl_numbers: List[str],
-                     tests: List[str], tag: str) -> str:
+def invokeForrestRun(branch: str, target: str, cl_numbers: Sequence[str],
+                     tests: Sequence[str], tag: str) -> str:
     """Submit a build/test to forrest."""
     gcl_path = test_paths.gcl_path()
     if tests:
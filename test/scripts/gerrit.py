@@ -18,34 +18,159 @@
 
 from typing import Any, Dict, NamedTuple
 import base64
+import concurrent.futures
 import contextlib
+import functools
+import http.cookiejar
 import json
 import logging
 import os
-import random
 import re
-import string
+import secrets
+import subprocess
+import tempfile
+import threading
 import urllib.parse
 
+try:
+    import requests
+except ImportError:
+    # Fall back to gob-curl for Gerrit requests.
+    requests = None
+
 import test_paths
 import utils
 
 AOSP_GERRIT_ENDPOINT = 'https://android-review.googlesource.com'
 
+# Clang details in the commit message of a CL uploaded by update-prebuilts.py.
+_PREBUILT_COMMIT_RE = re.compile(
+    r'clang (?P<ver>\d\d\.\d\.\d) \(based on (?P<rev>r\d+[a-z]?)\) ' +
+    r'from build (?P<bld>\d+)\.', re.ASCII)
+# Clang revision and version in a diff to build/soong's cc/config/global.go.
+_SOONG_REVISION_RE = re.compile(
+    r'\+\tClangDefaultVersion\s+= "clang-(?P<rev>r\d+)"', re.ASCII)
+_SOONG_VERSION_RE = re.compile(
+    r'\+\tClangDefaultShortVersion\s+= "(?P<ver>\d\d\.\d\.\d)"', re.ASCII)
+# Clang revision in a diff to kernel/common.
+_KERNEL_REVISION_RE = re.compile(r'\+.*clang-(?P<rev>r[0-9]+)/bin', re.ASCII)
+
+
+def _load_gitcookies(cookiefile: str) -> http.cookiejar.MozillaCookieJar:
+    """Return the cookies in git's http.cookiefile.
+
+    .gitcookies is in Netscape format but usually lacks the magic first line
+    MozillaCookieJar insists on, so such files are loaded from a private copy
+    with the line added.
+    """
+    jar = http.cookiejar.MozillaCookieJar()
+    with open(cookiefile) as infile:
+        contents = infile.read()
+    if contents.startswith('# Netscape HTTP Cookie File') or \
+       contents.startswith('# HTTP Cookie File'):
+        jar.load(cookiefile, ignore_discard=True, ignore_expires=True)
+        return jar
+    with tempfile.NamedTemporaryFile('w', suffix='.cookies') as outfile:
+        outfile.write('# Netscape HTTP Cookie File\n')
+        outfile.write(contents)
+        outfile.flush()
+        jar.load(outfile.name, ignore_discard=True, ignore_expires=True)
+    return jar
+
+
+def _has_gerrit_cookie(jar: http.cookiejar.CookieJar) -> bool:
+    host = urllib.parse.urlparse(AOSP_GERRIT_ENDPOINT).hostname
+    for cookie in jar:
+        domain = cookie.domain.lstrip('.')
+        if host == domain or host.endswith('.' + domain):
+            return True
+    return False
+
+
+# Seconds to wait for Gerrit to connect or send data before giving up.
+GERRIT_TIMEOUT_SECONDS = 60
+
+# Requests are made from several threads.  _session_lock guards creating the
+# session and _session_rejected, which is set once Gerrit rejects the session's
+# cookies; gob-curl is used from then on.
+_session_lock = threading.Lock()
+_session_rejected = False
+
+
+def _gerrit_session():
+    """Return the Gerrit session, or None if gob-curl should be used."""
+    with _session_lock:
+        if _session_rejected:
+            return None
+        return _create_gerrit_session()
+
+
+def _reject_gerrit_session() -> None:
+    global _session_rejected
+    with _session_lock:
+        _session_rejected = True
+
+
+@functools.lru_cache(maxsize=None)
+def _create_gerrit_session():
+    """Return a keep-alive HTTP session authenticated with git's cookies.
+
+    Return None if the requests module or git cookies for Gerrit are not
+    available, in which case requests go through gob-curl.
+    """
+    if requests is None:
+        return None
+    cookiefile = subprocess.run(
+        ['git', 'config', '--get', 'http.cookiefile'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        check=False).stdout.strip()
+    if not cookiefile:
+        return None
+    try:
+        jar = _load_gitcookies(os.path.expanduser(cookiefile))
+    except (OSError, http.cookiejar.LoadError) as e:
+        logging.info(f'Unable to load {cookiefile}, using gob-curl: {e}')
+        return None
+    if not _has_gerrit_cookie(jar):
+        logging.info(f'No cookies for {AOSP_GERRIT_ENDPOINT} in {cookiefile}, '
+                     'using gob-curl')
+        return None
+    session = requests.Session()
+    session.cookies.update(jar)
+    return session
+
 
 def gerrit_request(request: str) -> str:
     """Return JSON output of gerrit REST request.
 
     (https://gerrit-review.googlesource.com/Documentation/rest-api-changes.html)
     """
+    session = _gerrit_session()
+    if session:
+        # Authenticated REST endpoints are under /a/.
+        response = session.get(f'{AOSP_GERRIT_ENDPOINT}/a/{request}',
+                               timeout=GERRIT_TIMEOUT_SECONDS)
+        if response.status_code in (401, 403):
+            logging.info(f'Gerrit rejected git cookies ({response.status_code})'
+                         ', using gob-curl')
+            _reject_gerrit_session()
+        else:
+            response.raise_for_status()
+            return response.text
     return utils.check_output([
         'gob-curl', '--no-progress-meter', '--request', 'GET',
         f'{AOSP_GERRIT_ENDPOINT}/{request}'
     ])
 
 
+@functools.lru_cache(maxsize=512)
 def gerrit_request_json(request: str):
-    """Make gerrit request and parse the result into JSON."""
+    """Make gerrit request and parse the result into JSON.
+
+    Results are cached until clear_cache() is called.
+    """
     return json.loads(gerrit_request(request)[5:])
 
 
@@ -58,6 +183,7 @@ def gerrit_query_change(query: str):
     return gerrit_request_json(f'changes/?q={quoted}')
 
 
+@functools.lru_cache(maxsize=512)
 def gerrit_change_info(cl_number) -> Dict[str, Any]:
     """Return JSON output for gerrit change number"""
     json_output = gerrit_query_change(f'change:{cl_number}')
@@ -67,6 +193,17 @@ def gerrit_change_info(cl_number) -> Dict[str, Any]:
     return json_output[0]
 
 
+def _new_hashtag() -> str:
+    """Return a random hashtag used to discover the number of an uploaded CL."""
+    return 'chk-' + secrets.token_hex(4)
+
+
+def clear_cache() -> None:
+    """Drop cached Gerrit responses.  Call after uploading or updating a CL."""
+    gerrit_request_json.cache_clear()
+    gerrit_change_info.cache_clear()
+
+
 PREBUILTS_PROJECT = 'platform/prebuilts/clang/host/linux-x86'
 SOONG_PROJECT = 'platform/build/soong'
 KERNEL_COMMON_PROJECT = 'kernel/common'
@@ -83,7 +220,16 @@ class PrebuiltCL(NamedTuple):
     @staticmethod
     def getExistingCL(cl_number):
         """Extract prebuilt CL info from an existing CL."""
-        info = gerrit_change_info(cl_number)
+        # The REST requests are independent.  Issue them concurrently.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            info_future = executor.submit(gerrit_change_info, cl_number)
+            mergeable_future = executor.submit(
+                gerrit_request_json,
+                f'changes/{cl_number}/revisions/current/mergeable')
+            commit_future = executor.submit(
+                gerrit_request_json,
+                f'changes/{cl_number}/revisions/current/commit')
+        info = info_future.result()
 
         # Validate that the CL is in the correct project and doesn't have merge
         # conflicts.  (It's OK for the CL to be merged though.)
@@ -92,8 +238,7 @@ class PrebuiltCL(NamedTuple):
                 f'Prebuilt CL {cl_number} not in {PREBUILTS_PROJECT}')
 
         if info['status'] != 'MERGED':
-            mergeable_info = gerrit_request_json(
-                f'changes/{cl_number}/revisions/current/mergeable')
+            mergeable_info = mergeable_future.result()
             if not mergeable_info['mergeable']:
                 raise RuntimeError(
                     f'Prebuilt CL {cl_number} has merge conflicts')
@@ -101,11 +246,8 @@ class PrebuiltCL(NamedTuple):
         # Extract the revision, version, build from the commit message.  The
         # prebuilts are uploaded using the update-prebuilts.py script so we can
         # rely on it's commit message format.
-        commit = gerrit_request_json(
-            f'changes/{cl_number}/revisions/current/commit')
-        clang_info = re.search(
-            r'clang (?P<ver>\d\d.\d.\d) \(based on (?P<rev>r\d+[a-z]?)\) ' +
-            r'from build (?P<bld>\d+).', commit['message'])
+        commit = commit_future.result()
+        clang_info = _PREBUILT_COMMIT_RE.search(commit['message'])
         if not clang_info:
             raise RuntimeError('Cannot parse clang details from following ' +
                                'commit message for CL {cl_number}:\n' +
@@ -125,7 +267,7 @@ class PrebuiltCL(NamedTuple):
 
         logging.info(f'Uploading prebuilts CL for build {build_number}')
         # Add a random hashtag so we can discover the CL number.
-        hashtag = 'chk-' + ''.join(random.sample(string.digits, 8))
+        hashtag = _new_hashtag()
         utils.check_call([
             str(test_paths.LLVM_ANDROID_DIR / 'update-prebuilts.py'),
             f'--branch={branch}',
@@ -135,6 +277,7 @@ class PrebuiltCL(NamedTuple):
             f'--hashtag={hashtag}',
             build_number,
         ])
+        clear_cache()
 
         json_output = gerrit_query_change(f'hashtag:{hashtag}')
         if len(json_output) != 1:
@@ -146,7 +289,6 @@ class PrebuiltCL(NamedTuple):
         return self.build_number == other.build_number and \
             self.revision == other.revision and \
             self.version == other.version and \
-            self.build_number == other.build_number and \
             self.cl_number == other.cl_number
 
 
@@ -165,21 +307,25 @@ class SoongCL(NamedTuple):
             # Rewrite clang info in go initialization code of the form
             # ClangDefaultVersion           = "clang-r399163"
             # ClangDefaultShortVersion      = "11.0.4"
+            if '=' not in line:
+                return line
             replace = None
-            if 'ClangDefaultVersion' in line and '=' in line:
+            if 'ClangDefaultVersion' in line:
                 replace = 'clang-' + revision
-            elif 'ClangDefaultShortVersion' in line and '=' in line:
+            elif 'ClangDefaultShortVersion' in line:
                 replace = version
             if replace:
                 prefix, _, post = line.split('"')
                 return f'{prefix}"{replace}"{post}'
             return line
 
-        with open(soong_filepath) as soong_file:
-            contents = soong_file.readlines()
-        contents = list(map(rewrite, contents))
-        with open(soong_filepath, 'w') as soong_file:
-            soong_file.write(''.join(contents))
+        # Rewrite in a single pass to a temporary file and move it in place.
+        tmp_filepath = f'{soong_filepath}.tmp'
+        with open(soong_filepath) as soong_file, \
+             open(tmp_filepath, 'w') as tmp_file:
+            for line in soong_file:
+                tmp_file.write(rewrite(line))
+        os.replace(tmp_filepath, soong_filepath)
 
     @staticmethod
     def uploadCL(revision, version, changeId=None):
@@ -193,7 +339,7 @@ class SoongCL(NamedTuple):
                    f'{version}.\n\n' + 'For testing\n' + 'Test: N/A\n')
         if changeId is not None:
             message += (f'\nChange-Id: {changeId}\n')
-        hashtag = 'chk-' + ''.join(random.sample(string.digits, 8))
+        hashtag = _new_hashtag()
 
         @contextlib.contextmanager
         def chdir_context(directory):
@@ -208,7 +354,7 @@ class SoongCL(NamedTuple):
         #   - repo start
         #   - update clang version in soong
         #   - git commit
-        with chdir_context(test_paths.ANDROID_DIR / 'build' / 'soong'):
+        with chdir_context(test_paths.SOONG_DIR):
             utils.unchecked_call(['repo', 'abandon', branch, '.'])
             utils.check_call(['repo', 'sync', '-c', '.'])
             utils.check_call(['repo', 'start', branch, '.'])
@@ -229,6 +375,7 @@ class SoongCL(NamedTuple):
                 '--label=Code-Review-2',  # code-review -2
                 f'--hashtag={hashtag}',
             ])
+        clear_cache()
 
         json_output = gerrit_query_change(f'hashtag:{hashtag}')
         if len(json_output) != 1:
@@ -268,16 +415,13 @@ class SoongCL(NamedTuple):
         commit message may not have the info in a deterministic format.  Use the
         diff to cc/config/global.go to extract this info.
         """
-        regex_rev = r'\+\tClangDefaultVersion\s+= "clang-(?P<rev>r\d+)"'
-        regex_ver = r'\+\tClangDefaultShortVersion\s+= "(?P<ver>\d\d.\d.\d)"'
-
         go_file = 'cc/config/global.go'
         diff_b64 = gerrit_request(
             f'changes/{cl_number}/revisions/current/patch?path={go_file}')
         diff = base64.b64decode(diff_b64).decode('utf-8')
 
-        match_rev = re.search(regex_rev, diff)
-        match_ver = re.search(regex_ver, diff)
+        match_rev = _SOONG_REVISION_RE.search(diff)
+        match_ver = _SOONG_VERSION_RE.search(diff)
         if match_rev is None or match_ver is None:
             raise RuntimeError(f'Parsing clang info failed for {cl_number}')
         return match_rev.group('rev'), match_ver.group('ver')
@@ -294,7 +438,17 @@ class SoongCL(NamedTuple):
                       version=None,
                       try_resolve_conflict=True):
         """Find/parse build/soong switchover CL info from a gerrit CL."""
-        info = gerrit_change_info(cl_number)
+        # The REST requests are independent.  Issue them concurrently.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            info_future = executor.submit(gerrit_change_info, cl_number)
+            mergeable_future = executor.submit(
+                gerrit_request_json,
+                f'changes/{cl_number}/revisions/current/mergeable')
+            clang_info_future = None
+            if revision is None or version is None:
+                clang_info_future = executor.submit(SoongCL._parse_clang_info,
+                                                    cl_number)
+        info = info_future.result()
 
         # Validate that the CL is in the correct project and doesn't have merge
         # conflicts.  The CL should not be merged either.
@@ -305,11 +459,10 @@ class SoongCL(NamedTuple):
         if info['status'] == 'MERGED':
             raise RuntimeError(f'Switchover CL {cl_number} already merged.')
 
-        if revision is None or version is None:
-            revision, version = SoongCL._parse_clang_info(cl_number)
+        if clang_info_future:
+            revision, version = clang_info_future.result()
 
-        mergeable_info = gerrit_request_json(
-            f'changes/{cl_number}/revisions/current/mergeable')
+        mergeable_info = mergeable_future.result()
         if not mergeable_info['mergeable']:
             resolvable = SoongCL._is_trivial_switchover(cl_number)
             if resolvable and try_resolve_conflict:
@@ -345,7 +498,7 @@ class KernelCL(NamedTuple):
 
         logging.info(f'Uploading Kernel CL to switch to clang-{revision}')
         # Add a random hashtag so we can discover the CL number.
-        hashtag = 'chk-' + ''.join(random.sample(string.digits, 8))
+        hashtag = _new_hashtag()
         utils.check_call([
             str(test_paths.LLVM_ANDROID_DIR / 'update_kernel_toolchain.py'),
             kernel_repo_path,
@@ -357,6 +510,7 @@ class KernelCL(NamedTuple):
             '--no_topic',
             '--wip',
         ])
+        clear_cache()
 
         json_output = gerrit_query_change(f'hashtag:{hashtag}')
         if len(json_output) != 1:
@@ -378,7 +532,7 @@ class KernelCL(NamedTuple):
         diff_b64 = gerrit_request(
             f'changes/{cl_number}/revisions/current/patch')
         diff = base64.b64decode(diff_b64).decode('utf-8')
-        match = re.search('\+.*clang-(?P<rev>r[0-9]+)/bin', diff)
+        match = _KERNEL_REVISION_RE.search(diff)
         if not match:
             raise RuntimeError(
                 f'Cannot parse clang version from {cl_number}\'s diff: {diff}')
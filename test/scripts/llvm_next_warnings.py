@@ -105,7 +105,8 @@ def process_one_run(build, target):
 def process_tag(tag):
     warnings = set()
     cns_path = test_paths.cns_path()
-    testResults = TestResultsTable(f'{cns_path}/{test_paths.TEST_RESULTS_CSV}')
+    testResults = TestResultsTable.fromCNS(
+        f'{cns_path}/{test_paths.TEST_RESULTS_CSV}')
     for record in testResults.records:
         if record.tag != tag or record.work_type != 'BUILD':
             continue
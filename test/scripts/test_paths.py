@@ -17,11 +17,12 @@
 
 from typing import Dict
 from pathlib import Path
-import yaml
+import functools
 
 TEST_SCRIPTS_DIR: Path = Path(__file__).resolve().parent
 LLVM_ANDROID_DIR: Path = TEST_SCRIPTS_DIR.parents[1]
 ANDROID_DIR: Path = TEST_SCRIPTS_DIR.parents[3]
+SOONG_DIR: Path = ANDROID_DIR / 'build' / 'soong'
 CONFIGS_YAML: Path = TEST_SCRIPTS_DIR / 'test_configs.yaml'
 CLUSTER_INFO_YAML: Path = TEST_SCRIPTS_DIR / 'cluster_info.yaml'
 
@@ -33,6 +34,10 @@ GCL_KEY_FILE: Path = Path(
 INTERNAL_NAMES_YAML: Path = Path(
     '/google/data/ro/teams/android-llvm/tests/internal_names.yaml')
 
+# Per-user cache, kept out of the source checkout.
+CACHE_DIR: Path = Path.home() / '.cache' / 'llvm_android'
+CONFIGS_YAML_CACHE: Path = CACHE_DIR / 'test_configs.yaml.pkl'
+
 SOONG_CSV: str = 'soong_cls.csv'
 KERNEL_CSV: str = 'kernel_cls.csv'
 PREBUILT_CSV: str = 'prebuilt_cls.csv'
@@ -41,16 +46,18 @@ FORREST_CSV: str = 'forrest.csv'
 TEST_RESULTS_CSV: str = 'test_results.csv'
 
 
+@functools.lru_cache(maxsize=None)
 def _read_key_file(key_file: Path) -> str:
-    with open(key_file) as infile:
-        return infile.read().strip()
+    return key_file.read_text().strip()
 
 
+@functools.lru_cache(maxsize=1)
 def cns_path() -> str:
     """Read path to CNS testdata from CNS_KEY_FILE."""
     return _read_key_file(CNS_KEY_FILE)
 
 
+@functools.lru_cache(maxsize=1)
 def gcl_path() -> str:
     """Read path to testbench GCLs from GCL_KEY_FILE."""
     return _read_key_file(GCL_KEY_FILE)
@@ -63,5 +70,6 @@ def internal_names() -> Dict[str, str]:
     global _internal_names_dict
     if _internal_names_dict:
         return _internal_names_dict
+    import yaml  # Imported lazily since most users of this module don't need it.
     _internal_names_dict = yaml.safe_load(_read_key_file(INTERNAL_NAMES_YAML))
     return _internal_names_dict
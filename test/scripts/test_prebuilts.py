@@ -17,22 +17,36 @@
 # pylint: disable=invalid-name
 """Test Clang prebuilts on Android"""
 
-from typing import List, NamedTuple, Optional, Set, Tuple
+from __future__ import annotations
+
+from typing import (TYPE_CHECKING, Any, Dict, FrozenSet, List, NamedTuple,
+                    Optional, Sequence, Set, Tuple)
 import argparse
+import concurrent.futures
+import functools
 import inspect
+import itertools
 import logging
+import os
 import pathlib
+import pickle
+import re
+import subprocess
 import sys
-import yaml
+import tempfile
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
 
 from data import CNSData, KernelCLRecord, PrebuiltCLRecord, SoongCLRecord, WorkNodeRecord
-import forrest
-import gerrit
 import test_paths
 import utils
 
+# yaml, gerrit, forrest and ab_client are imported where they are used, so that
+# paths that don't need them (e.g. --help) don't pay for importing them.
+# Importing forrest also runs a subprocess and parses cluster_info.yaml.
+if TYPE_CHECKING:
+    import gerrit
+
 CODE_NAMES = [
     'RELEASE_BRANCH_1', 'RELEASE_BRANCH_2', 'RELEASE_BRANCH_3',
     'DEVICE_TARGET_1'
@@ -42,8 +56,8 @@ CODE_NAMES = [
 class TestConfig(NamedTuple):
     branch_private: str  # use branch property instead
     target_private: str  # use branch property instead
-    groups: List[str]
-    tests: List[str]
+    groups: FrozenSet[str]
+    tests: Tuple[str, ...]
 
     def __str__(self):
         return f'{self.branch}:{self.target}'
@@ -65,18 +79,57 @@ class TestConfig(NamedTuple):
         return self.branch.startswith('aosp_kernel')
 
 
-def _load_configs() -> List[TestConfig]:
+def _read_configs_yaml() -> Dict[str, Any]:
+    """Return the parsed contents of CONFIGS_YAML.
+
+    The parsed data is cached in CONFIGS_YAML_CACHE, keyed by the path, mtime
+    and size of CONFIGS_YAML, so the YAML is parsed again only when it changes
+    (or another checkout's file was cached last).
+    """
+    stat = test_paths.CONFIGS_YAML.stat()
+    key = (str(test_paths.CONFIGS_YAML), stat.st_mtime_ns, stat.st_size)
+    try:
+        with open(test_paths.CONFIGS_YAML_CACHE, 'rb') as infile:
+            cached_key, configs = pickle.load(infile)
+        if cached_key == key:
+            return configs
+    except (OSError, EOFError, pickle.UnpicklingError, TypeError, ValueError):
+        # Missing or corrupt cache.  Parse the YAML file instead.
+        pass
+
+    import yaml
+    try:
+        # Use the libyaml C parser when available.
+        from yaml import CSafeLoader as YamlLoader
+    except ImportError:
+        from yaml import SafeLoader as YamlLoader
     with open(test_paths.CONFIGS_YAML) as infile:
-        configs = yaml.safe_load(infile)
+        configs = yaml.load(infile, Loader=YamlLoader)
+
+    # Write the cache atomically.  Failing to write it is not an error.
+    cache_dir = test_paths.CONFIGS_YAML_CACHE.parent
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                'wb', dir=cache_dir, delete=False) as outfile:
+            pickle.dump((key, configs), outfile)
+        os.replace(outfile.name, test_paths.CONFIGS_YAML_CACHE)
+    except OSError:
+        logging.debug(f'Unable to write {test_paths.CONFIGS_YAML_CACHE}')
+    return configs
+
+
+def _load_configs() -> List[TestConfig]:
+    configs = _read_configs_yaml()
     result = []
     for branch, targets in configs.items():
         for target, target_config in targets.items():
             if target_config:
                 # groups and tests can be empty.
-                groups = target_config.get('groups', '').split()
-                tests = target_config.get('tests', list())
+                groups = frozenset(target_config.get('groups', '').split())
+                tests = tuple(target_config.get('tests', ()))
             else:
-                groups, tests = list(), list()
+                groups, tests = frozenset(), ()
             result.append(
                 TestConfig(
                     branch_private=branch,
@@ -88,14 +141,19 @@ def _load_configs() -> List[TestConfig]:
 
 
 def _find_groups(all_configs: List[TestConfig]) -> Set[str]:
-    groups = set()
-    for config in all_configs:
-        groups.update(config.groups)
-    return groups
+    return set(itertools.chain.from_iterable(c.groups for c in all_configs))
+
 
+@functools.lru_cache(maxsize=1)
+def get_test_configs() -> List[TestConfig]:
+    """Return test configs from CONFIGS_YAML, loading them on first use."""
+    return _load_configs()
 
-TEST_CONFIGS = _load_configs()
-TEST_GROUPS = _find_groups(TEST_CONFIGS)
+
+@functools.lru_cache(maxsize=1)
+def get_test_groups() -> Set[str]:
+    """Return the groups referenced by any test config."""
+    return _find_groups(get_test_configs())
 
 
 class ToolchainBuild(NamedTuple):
@@ -104,9 +162,70 @@ class ToolchainBuild(NamedTuple):
     branch: str
 
 
+# Example output of `ab get --raw` is:
+#   aosp-llvm-toolchain linux 6732143 complete True
+# Only the branch, attempt status and success fields are needed.
+_AB_GET_OUTPUT_RE = re.compile(r'\s*(\S+)\s+\S+\s+\S+\s+(\S+)\s+(\S+)')
+
+
+@functools.lru_cache(maxsize=None)
 def get_toolchain_build(build) -> ToolchainBuild:
-    """Return ToolchainBuild record for a build."""
+    """Return ToolchainBuild record for a build.
+
+    Results are memoized.  Build info for a build number doesn't change once
+    the build has completed successfully, and only such builds are returned.
+    """
     toolchain_branches = ('aosp-llvm-toolchain', 'aosp-llvm-toolchain-testing')
+    branch, complete, success = _get_build_info(build)
+    is_testable = branch in toolchain_branches and complete == 'complete' and \
+                  success == 'True'
+    if not is_testable:
+        raise RuntimeError(f'Build {build} is not testable.  '
+                           f'Build info is {branch} {complete} {success}')
+    return ToolchainBuild(build, branch)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_build_api():
+    """Return (client, errors) for the Android build API, or None.
+
+    errors is the tuple of exceptions a failed API request raises.  The client
+    is created once: setting it up runs stubby and fetches the discovery
+    document, which costs more than a single `ab` call.
+    """
+    try:
+        import ab_client
+    except ImportError as e:
+        logging.info(f'Android build API unavailable, using ab: {e}')
+        return None
+    errors = (OSError, subprocess.CalledProcessError,
+              ab_client.apiclient.errors.Error,
+              ab_client.httplib2.HttpLib2Error)
+    try:
+        return ab_client.AndroidBuildClient(), errors
+    except errors as e:
+        logging.info(f'Android build API unavailable, using ab: {e!r}')
+        return None
+
+
+def _get_build_info(build) -> Tuple[str, str, str]:
+    """Return (branch, attempt status, success) of a linux build.
+
+    The Android build API is used when it is available, falling back to the
+    `ab` CLI if the API can't be imported, authenticated or queried.
+    """
+    info = None
+    api = _get_build_api()
+    if api:
+        client, errors = api
+        try:
+            info = client.get_build(build, 'linux')
+        except errors as e:
+            logging.info(f'Android build API query failed, using ab: {e!r}')
+    if info:
+        return (info['branch'], info['buildAttemptStatus'],
+                str(info.get('successful', False)))
+
     output = utils.check_output([
         '/google/data/ro/projects/android/ab',
         'get',
@@ -114,22 +233,17 @@ def get_toolchain_build(build) -> ToolchainBuild:
         f'--bid={build}',
         '--target=linux'
     ])
-    # Example output is:
-    #   aosp-llvm-toolchain linux 6732143 complete True
-    branch, _, _, complete, success = output.split()
-    is_testable = branch in toolchain_branches and complete == 'complete' and \
-                  success == 'True'
-    if not is_testable:
-        raise RuntimeError(f'Build {build} is not testable.  '
-                           f'Build info is {output}')
-    return ToolchainBuild(build, branch)
+    match = _AB_GET_OUTPUT_RE.match(output)
+    if not match:
+        raise RuntimeError(f'Unexpected ab output for build {build}: {output}')
+    return match.group(1, 2, 3)
 
 
 def do_prechecks():
     # ensure build/soong is present.
     # TODO(pirama) build/soong is only necessary if we're uploading a new CL.
     # Consider moving this deeper.
-    if not (test_paths.ANDROID_DIR / 'build' / 'soong').exists():
+    if not test_paths.SOONG_DIR.exists():
         raise RuntimeError('build/soong does not exist.  ' +\
                            'Execute this script in master-plus-llvm branch.')
 
@@ -162,6 +276,7 @@ def getPrebuiltCL(build: ToolchainBuild,
 
     Upload new CLs to gerrit if matching CLs not found in CNS data.
     """
+    import gerrit
     prebuiltRow = CNSData.Prebuilts.getPrebuilt(build.build_number, cl_number)
     if prebuiltRow:
         prebuiltCL = gerrit.PrebuiltCL.getExistingCL(prebuiltRow.cl_number)
@@ -197,6 +312,7 @@ def getSoongCL(revision: str, version: str,
 
     Upload new CLs to gerrit if matching CLs not found in CNS data.
     """
+    import gerrit
     soongRow = CNSData.SoongCLs.getCL(revision, version, cl_number)
     if soongRow:
         soongCL = gerrit.SoongCL.getExistingCL(soongRow.cl_number)
@@ -227,6 +343,7 @@ def getKernelCL(revision: str, version: str, cl_number: Optional[str],
 
     Upload new CLs to gerrit if matching CLs not found in CNS data.
     """
+    import gerrit
     kernelRow = CNSData.KernelCLs.getCL(revision, cl_number)
     if kernelRow:
         kernelCL = gerrit.KernelCL.getExistingCL(kernelRow.cl_number)
@@ -256,7 +373,7 @@ def getKernelCL(revision: str, version: str, cl_number: Optional[str],
 
 
 def evaluateConfig(retry_policy: str, build: str, tag: str, branch: str,
-                   target: str, tests: List[str]) -> str:
+                   target: str, tests: Sequence[str]) -> str:
     pending_row = CNSData.PendingWorkNodes.find(build, tag, branch, target)
     completed_row = CNSData.CompletedWorkNodes.find(build, tag, branch, target)
 
@@ -282,20 +399,22 @@ def evaluateConfig(retry_policy: str, build: str, tag: str, branch: str,
 
     # either retry_policy == 'all' or we have a failed run.  Delete data and
     # retry.
-    if pending_row:
-        CNSData.PendingWorkNodes.remove(pending_row)
-    if completed_row:
-        CNSData.CompletedWorkNodes.remove(completed_row)
-    for record in result_records:
-        CNSData.TestResults.remove(record)
+    with CNSData.batch():
+        if pending_row:
+            CNSData.PendingWorkNodes.remove(pending_row)
+        if completed_row:
+            CNSData.CompletedWorkNodes.remove(completed_row)
+        for record in result_records:
+            CNSData.TestResults.remove(record)
     return 'retry'
 
 
 def invokeForrestRuns(cls, args):
     """Submit builds/tests to Forrest for provided CLs and args."""
+    import forrest
     build, tag = args.build, args.tag
 
-    to_run = set(args.groups) if args.groups else set()
+    to_run = frozenset(args.groups or ())
 
     def _should_run(config):
         # Do not run test if this config is disabled in TestKindConfig.
@@ -312,21 +431,33 @@ def invokeForrestRuns(cls, args):
             return True
 
         # Run test if it is a part of a group specified in args.groups
-        return any(g in to_run for g in config.groups)
+        return not to_run.isdisjoint(config.groups)
+
+    # CLs to include in kernel and platform runs.  These are shared by all
+    # submissions, so build them once as immutable tuples.
+    prebuilt_cl_numbers = ()
+    if not cls['prebuiltsCL'].merged:
+        prebuilt_cl_numbers = (cls['prebuiltsCL'].cl_number,)
+    if TestKindConfig.kernel:
+        kernel_cl_numbers = prebuilt_cl_numbers + (cls['kernelCL'].cl_number,)
+    if TestKindConfig.platform:
+        platform_cl_numbers = prebuilt_cl_numbers + (
+            cls['soongCL'].cl_number,) + tuple(args.extra_cls_platform or ())
 
     def _get_cl_numbers(config):
-        cl_numbers = []
-        if not cls['prebuiltsCL'].merged:
-            cl_numbers.append(cls['prebuiltsCL'].cl_number)
         if config.is_kernel_branch:
-            cl_numbers.append(cls['kernelCL'].cl_number)
-        else:
-            cl_numbers.append(cls['soongCL'].cl_number)
-            if args.extra_cls_platform:
-                cl_numbers.extend(args.extra_cls_platform)
-        return cl_numbers
-
-    for config in TEST_CONFIGS:
+            return kernel_cl_numbers
+        return platform_cl_numbers
+
+    # (build, tag, branch, target) of every previously-scheduled config.
+    workNodeKey = ('prebuilt_build_number', 'tag', 'branch', 'target')
+    scheduled = (CNSData.PendingWorkNodes.indexValues(workNodeKey) |
+                 CNSData.CompletedWorkNodes.indexValues(workNodeKey))
+
+    # Decide which configs to submit.  This updates CNS data for retried
+    # configs, so do it serially.
+    to_submit = []
+    for config in get_test_configs():
         if not _should_run(config):
             logging.info(f'Skipping disabled config {config}')
             continue
@@ -336,8 +467,11 @@ def invokeForrestRuns(cls, args):
         target = config.target
         tests = config.tests
 
-        evaluation = evaluateConfig(args.retry_policy, build, tag, branch,
-                                    target, tests)
+        if (build, tag, branch, target) in scheduled:
+            evaluation = evaluateConfig(args.retry_policy, build, tag, branch,
+                                        target, tests)
+        else:
+            evaluation = 'run'
         if evaluation == 'skip':
             logging.info(f'Skipping previously-scheduled config {config}')
             continue
@@ -345,17 +479,46 @@ def invokeForrestRuns(cls, args):
             logging.info(
                 f'Retrying {config} based on retry policy \'{args.retry_policy}\''
             )
-
-        invocation_id = forrest.invokeForrestRun(branch, target, cl_numbers,
-                                                 tests, args.tag)
-        logging.info(f'Submitted {config} to forrest: {invocation_id}')
-        record = WorkNodeRecord(
-            prebuilt_build_number=build,
-            invocation_id=invocation_id,
-            tag=tag,
-            branch=branch,
-            target=target)
-        CNSData.PendingWorkNodes.addInvocation(record)
+        to_submit.append((config, branch, target, cl_numbers, tests))
+
+    # Forrest submissions are independent and dominated by network latency.
+    # Submit them concurrently and record each invocation as it completes.
+    # Records are written back to CNS once, after all submissions finish, or
+    # when submission is interrupted, so that a rerun doesn't submit the
+    # recorded invocations again.
+    failed = []
+    recorded = False
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {}
+            for config, branch, target, cl_numbers, tests in to_submit:
+                future = executor.submit(forrest.invokeForrestRun, branch,
+                                         target, cl_numbers, tests, args.tag)
+                futures[future] = (config, branch, target)
+            for future in concurrent.futures.as_completed(futures):
+                config, branch, target = futures[future]
+                if future.exception():
+                    logging.error(f'Submitting {config} to forrest failed: ' +
+                                  str(future.exception()))
+                    failed.append(config)
+                    continue
+                invocation_id = future.result()
+                logging.info(f'Submitted {config} to forrest: {invocation_id}')
+                record = WorkNodeRecord(
+                    prebuilt_build_number=build,
+                    invocation_id=invocation_id,
+                    tag=tag,
+                    branch=branch,
+                    target=target)
+                CNSData.PendingWorkNodes.addInvocation(record, writeBack=False)
+                recorded = True
+    finally:
+        if recorded:
+            CNSData.PendingWorkNodes.write()
+
+    if failed:
+        raise RuntimeError('Submitting to forrest failed for: ' +
+                           ', '.join(str(config) for config in failed))
 
 
 def parse_args():
@@ -382,10 +545,10 @@ def parse_args():
     parser.add_argument(
         '--groups',
         metavar='GROUP',
-        choices=TEST_GROUPS,
         nargs='+',
         action='extend',
-        help=f'Run tests from specified groups.  Choices: {TEST_GROUPS}')
+        help=('Run tests from specified groups.  Groups are listed in ' +
+              f'{test_paths.CONFIGS_YAML.name}.'))
     test_kind_choices = ['platform', 'kernel']
     parser.add_argument(
         '--test_kind',
@@ -413,6 +576,14 @@ def parse_args():
         '--verbose', '-v', action='store_true', help='Print verbose output')
 
     args = parser.parse_args()
+    if args.groups:
+        # Validate here rather than with choices= so that test configs are
+        # only loaded when --groups is used.
+        test_groups = get_test_groups()
+        unknown = set(args.groups) - test_groups
+        if unknown:
+            parser.error(f'unknown groups: {sorted(unknown)}.  ' +
+                         f'Choices: {sorted(test_groups)}')
     if not args.prepare_only and not args.tag:
         raise RuntimeError('Provide a --tag argument for Forrest invocations' +
                            ' or use --prepare-only to only prepare Gerrit CLs.')
@@ -17,6 +17,7 @@
 # pylint: disable=invalid-name
 """Monitor forrest runs and update status of completed runs."""
 
+import concurrent.futures
 import logging
 import pathlib
 import sys
@@ -36,22 +37,29 @@ def main():
         print(f'{sys.argv[0]} doesn\'t accept any arguments')
         sys.exit(1)
 
-    CNSData.loadCNSData()
-    build_client = ab_client.AndroidBuildClient()
+    # Setting up the build API client (OAuth token, discovery document) and
+    # reading CNS are independent and both wait on I/O, so overlap them.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        client_future = executor.submit(ab_client.AndroidBuildClient)
+        CNSData.loadCNSData()
+        build_client = client_future.result()
 
+    # Skip querying invocations that already exist in CNSData.Forrest.
     completed = list()
+    queries = list()
     for pending in CNSData.PendingWorkNodes.records:
-        inv = pending.invocation_id
-        # Remove the pending record if it already exists in CNSData.Forrest or
-        # if its invocation has finished execution.
-        complete = CNSData.CompletedWorkNodes.findByInvocation(inv)
-
-        if not complete:
-            complete, results = build_client.get_worknode_status(
-                inv, pending.tag)
-            for result in results:
-                CNSData.TestResults.addResult(result, writeBack=False)
+        if CNSData.CompletedWorkNodes.findByInvocation(pending.invocation_id):
+            completed.append(pending)
+        else:
+            queries.append(pending)
 
+    statuses = build_client.get_worknode_statuses(
+        [(pending.invocation_id, pending.tag) for pending in queries])
+    for pending in queries:
+        # Remove the pending record if its invocation has finished execution.
+        complete, results = statuses[pending.invocation_id]
+        for result in results:
+            CNSData.TestResults.addResult(result, writeBack=False)
         if complete:
             completed.append(pending)
 
@@ -59,9 +67,13 @@ def main():
         CNSData.CompletedWorkNodes.addInvocation(record, writeBack=False)
         CNSData.PendingWorkNodes.remove(record, writeBack=False)
 
-    CNSData.TestResults.write()
-    CNSData.CompletedWorkNodes.write()
-    CNSData.PendingWorkNodes.write()
+    # The tables are separate CNS files, so write them back concurrently.
+    tables = (CNSData.TestResults, CNSData.CompletedWorkNodes,
+              CNSData.PendingWorkNodes)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(tables)) as executor:
+        for future in [executor.submit(table.write) for table in tables]:
+            future.result()
 
 
 if __name__ == '__main__':
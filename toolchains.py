@@ -33,92 +33,92 @@ class Toolchain:
         self.path = path
         self.build_path = build_path
 
-    @property
+    @functools.cached_property
     def cc(self) -> Path:  # pylint: disable=invalid-name
         """Returns the path to c compiler."""
         return self.path / 'bin' / 'clang'
 
-    @property
+    @functools.cached_property
     def cxx(self) -> Path:
         """Returns the path to c++ compiler."""
         return self.path / 'bin' / 'clang++'
 
-    @property
+    @functools.cached_property
     def cl(self) -> Path:
         """Returns the path to windows c++ compiler."""
         return self.path / 'bin' / 'clang-cl'
 
-    @property
+    @functools.cached_property
     def ar(self) -> Path:
         """Returns the path to llvm-ar."""
         return self.path / 'bin' / 'llvm-ar'
 
-    @property
+    @functools.cached_property
     def lipo(self) -> Path:
         """Returns the path to llvm-lipo."""
         return self.path / 'bin' / 'llvm-lipo'
 
-    @property
+    @functools.cached_property
     def lld(self) -> Path:
         """Returns the path to ld.lld."""
         return self.path / 'bin' / 'ld.lld'
 
-    @property
+    @functools.cached_property
     def lld_link(self) -> Path:
         """Returns the path to lld-link."""
         return self.path / 'bin' / 'lld-link'
 
-    @property
+    @functools.cached_property
     def rc(self) -> Path:
         """Returns the path to llvm-windres."""
         return self.path / 'bin' / 'llvm-windres'
 
-    @property
+    @functools.cached_property
     def ranlib(self) -> Path:
         """Returns the path to llvm-ranlib."""
         return self.path / 'bin' / 'llvm-ranlib'
 
-    @property
+    @functools.cached_property
     def addr2line(self) -> Path:
         """Returns the path to llvm-addr2line."""
         return self.path / 'bin' / 'llvm-addr2line'
 
-    @property
+    @functools.cached_property
     def nm(self) -> Path:
         """Returns the path to llvm-nm."""
         return self.path / 'bin' / 'llvm-nm'
 
-    @property
+    @functools.cached_property
     def objcopy(self) -> Path:
         """Returns the path to llvm-objcopy."""
         return self.path / 'bin' / 'llvm-objcopy'
 
-    @property
+    @functools.cached_property
     def objdump(self) -> Path:
         """Returns the path to llvm-objdump."""
         return self.path / 'bin' / 'llvm-objdump'
 
-    @property
+    @functools.cached_property
     def readelf(self) -> Path:
         """Returns the path to llvm-readelf."""
         return self.path / 'bin' / 'llvm-readelf'
 
-    @property
+    @functools.cached_property
     def mt(self) -> Path:
         """Returns the path to llvm-mt."""
         return self.path / 'bin' / 'llvm-mt'
 
-    @property
+    @functools.cached_property
     def strip(self) -> Path:
         """Returns the path to llvm-strip."""
         return self.path / 'bin' / 'llvm-strip'
 
-    @property
+    @functools.cached_property
     def lib_dirs(self) -> List[Path]:
         """Returns the paths to lib dirs."""
         return [self.path / 'lib', self.path / 'lib' / 'x86_64-unknown-linux-gnu', self.path / 'lib' / 'x86_64-unknown-linux-musl']
 
-    @property
+    @functools.cached_property
     def _version_file(self) -> Path:
         return self.path / 'include' / 'clang' / 'Basic'/ 'Version.inc'
 
@@ -126,19 +126,20 @@ class Toolchain:
     def version(self) -> version.Version:
         return version.Version(self._version_file)
 
-    @property
+    @functools.cached_property
     def clang_lib_dir(self) -> Path:
         return self.lib_dirs[0] / 'clang' / self.version.major_version()
 
-    @property
+    @functools.cached_property
     def clang_builtin_header_dir(self) -> Path:
         return self.clang_lib_dir / 'include'
 
-    @property
+    @functools.cached_property
     def libcxx_headers(self) -> Path:
         return self.path / 'include' / 'c++' / 'v1'
 
 
+@functools.lru_cache(maxsize=None)
 def get_prebuilt_toolchain() -> Toolchain:
     """Returns the prebuilt toolchain."""
     # Prebuilt toolchain doesn't have a build path. Use a temp path instead.
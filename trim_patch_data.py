@@ -89,10 +89,10 @@ def main():
         print('No patches to remove')
         return
 
-    # Apply the changes to git and commit.
+    # Apply the changes to git and commit.  `git rm` refuses to delete patches
+    # with local modifications, so keep it rather than unlinking them here.
     utils.check_call(['git', 'add', _PATCH_JSON])
-    for patch in removed_patches:
-        utils.check_call(['git', 'rm', str(patch)])
+    utils.check_call(['git', 'rm', '--'] + [str(p) for p in removed_patches])
 
     message_lines = [
         f'Remove patch entries older than {_SVN_REVISION}.',
@@ -17,7 +17,6 @@
 # pylint: disable=not-callable, relative-import, line-too-long, no-else-return
 
 import argparse
-import fileinput
 import os.path as path
 import re
 import subprocess
@@ -28,9 +27,9 @@ def green_print(to_print):
     print("\033[92m" + to_print + "\033[0m")
 
 
-def is_clang_project(element):
-    return element.tag == "project" and \
-           element.get("path") == "prebuilts-master/clang/host/linux-x86"
+# Opening tag of the clang prebuilts <project> element in the manifest.
+CLANG_PROJECT_RE = re.compile(
+    r'<project\b[^>]*\bpath="prebuilts-master/clang/host/linux-x86"[^>]*>')
 
 
 class KernelToolchainUpdater():
@@ -114,9 +113,8 @@ class KernelToolchainUpdater():
 
     def get_clang_sha(self):
         clang_dir = path.dirname(self.clang_bin)
-        output = subprocess.check_output(
-            ["git", "--no-pager", "log", "-n", "1"], cwd=clang_dir).decode("utf-8")
-        self.clang_sha = re.search("commit ([0-9a-z]+)", output).groups()[0]
+        self.clang_sha = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=clang_dir).decode("utf-8").strip()
 
     def update_sha(self):
         green_print("Updating SHA")
@@ -126,17 +124,17 @@ class KernelToolchainUpdater():
             return
         # It would be great to just use the builtin XML serializer/deserializer
         # in a sane way; unfortunately this will end up reformatting
-        # indentation and reordering element attributes.
-        for line in fileinput.input(xml_path, inplace=True):
-            try:
-                element = ET.fromstring(line)
-                if is_clang_project(element):
-                    line = re.sub("revision=\"[0-9a-z]+\"",
-                                  "revision=\"%s\"" % self.clang_sha, line)
-            except ET.ParseError:
-                pass
-            finally:
-                print(line, end="")
+        # indentation and reordering element attributes.  Rewrite the
+        # revision attribute of the clang project tag in place instead.
+        with open(xml_path) as xml_file:
+            manifest = xml_file.read()
+        manifest = CLANG_PROJECT_RE.sub(
+            lambda match: re.sub("revision=\"[0-9a-z]+\"",
+                                 "revision=\"%s\"" % self.clang_sha,
+                                 match.group(0)),
+            manifest)
+        with open(xml_path, "w") as xml_file:
+            xml_file.write(manifest)
 
     def commit_sha(self):
         green_print("Committing SHA")
@@ -154,9 +152,12 @@ Bug: %s
 
     def push_manifest_change(self):
         green_print("Pushing manifest change")
-        output = subprocess.check_output(["repo", "--no-pager", "info"],
-                                         cwd=self.repo_dir).decode("utf-8")
-        repo_branch = output.split("\n")[1].split(" ")[3].split("/")[2]
+        # repo records the manifest branch (what `repo info` reports as
+        # "Manifest branch") in the manifest repository's git config.
+        output = subprocess.check_output(
+            ["git", "config", "--get", "branch.default.merge"],
+            cwd=self.repo_dir).decode("utf-8").strip()
+        repo_branch = output.split("/")[2]
         command = "git push origin HEAD:refs/for/" + repo_branch
 
         if self.wip:
@@ -184,10 +185,12 @@ Bug: %s
         if self.dry_run:
             print("Updating %s to use %s." % (config_path, self.clang_revision))
             return
-        for line in fileinput.input(config_path, inplace=True):
-            line = re.sub("CLANG_VERSION=r[0-9a-z]+",
-                          "CLANG_VERSION=" + self.clang_revision, line)
-            print(line, end="")
+        with open(config_path) as config_file:
+            config = config_file.read()
+        config = re.sub("CLANG_VERSION=r[0-9a-z]+",
+                        "CLANG_VERSION=" + self.clang_revision, config)
+        with open(config_path, "w") as config_file:
+            config_file.write(config)
 
     def commit_kernel_toolchain(self):
         green_print("Committing kernel toolchain")
@@ -19,11 +19,13 @@
 """Update the prebuilt clang from the build server."""
 
 import argparse
+import concurrent.futures
 import glob
 import inspect
 import logging
 import os
 from pathlib import Path
+from typing import Optional
 import shutil
 import subprocess
 import sys
@@ -102,43 +104,45 @@ class ArgParser(argparse.ArgumentParser):
             help='Extra hashtags (comma separated) during \'repo upload\'')
 
 
-def fetch_artifact(branch, target, build, pattern):
+def fetch_artifact(branch, target, build, pattern, cwd=None):
     fetch_artifact_path = '/google/data/ro/projects/android/fetch_artifact'
     cmd = [fetch_artifact_path, f'--branch={branch}',
            f'--target={target}', f'--bid={build}', pattern]
-    utils.check_call(cmd)
+    utils.check_call(cmd, cwd=cwd)
+
+
+def fetch_artifacts(executor, jobs):
+    """Submits fetch_artifact to executor for each tuple of arguments in jobs.
+
+    Jobs that download to the same directory must fetch different file names.
+    """
+    return [executor.submit(fetch_artifact, *job) for job in jobs]
 
 
 def extract_clang_info(clang_dir):
     version_file_path = os.path.join(clang_dir, 'AndroidVersion.txt')
     with open(version_file_path) as version_file:
         # e.g. for contents: ['7.0.1', 'based on r326829']
-        contents = [l.strip() for l in version_file.readlines()]
-        full_version = contents[0]
+        full_version = version_file.readline().strip()
         major_version = full_version.split('.')[0]
-        revision = contents[1].split()[-1]
+        revision = version_file.readline().split()[-1]
         return full_version, major_version, revision
 
 
-def symlink_to_linux_resource_dir(install_dir):
-    # Assume we're in a Darwin (non-linux) prebuilt dir.  Find the Clang version
-    # string.  Pick the longest string, if there's more than one.
-    version_dirs = os.listdir(os.path.join(install_dir, 'lib', 'clang'))
+def symlink_to_linux_resource_dir(prebuilt_dir: Path, install_subdir: str) -> None:
+    # Assume prebuilt_dir is a Darwin (non-linux) prebuilt dir.  Find the Clang
+    # version string.  Pick the longest string, if there's more than one.
+    version_dirs = os.listdir(os.path.join(prebuilt_dir, install_subdir, 'lib', 'clang'))
     if version_dirs:
         version_dirs.sort(key=len)
     version_dir = version_dirs[-1]
 
-    symlink_dir = os.path.join(install_dir, 'lib', 'clang', version_dir,
+    symlink_dir = os.path.join(install_subdir, 'lib', 'clang', version_dir,
                                'lib')
     link_src = os.path.join('/'.join(['..'] * 6), 'linux-x86', symlink_dir,
                             'linux')
-    link_dst = 'linux'
-
-    # 'cd' to symlink_dir and create a symlink from link_dst to link_src
-    prebuilt_dir = os.getcwd()
-    os.chdir(symlink_dir)
+    link_dst = os.path.join(prebuilt_dir, symlink_dir, 'linux')
     os.symlink(link_src, link_dst)
-    os.chdir(prebuilt_dir)
 
 
 def validity_check(host, install_dir, clang_version_major):
@@ -170,9 +174,8 @@ def validity_check(host, install_dir, clang_version_major):
     # Check that all the files listed in remote_toolchain_inputs are valid
     if host == 'linux-x86':
       with open(os.path.join(install_dir, 'bin', 'remote_toolchain_inputs')) as inputs_file:
-        files = [line.strip() for line in inputs_file.readlines()]
         fail = False
-        for f in files:
+        for f in map(str.strip, inputs_file):
           if not os.path.exists(os.path.join(install_dir, 'bin', f)):
             logger().error(f'remote_toolchain_inputs malformed, {f} does not exist')
             fail = True
@@ -194,17 +197,21 @@ def format_bug(bug):
     return bug
 
 
-def update_clang(host, build_number, use_current_branch, download_dir, bug,
-                 manifest, overwrite, do_validity_check, is_testing):
-    prebuilt_dir = paths.PREBUILTS_DIR / 'clang' / 'host' / host
-    os.chdir(prebuilt_dir)
+def start_branches(hosts, build_number):
+    """Starts the update branch in the prebuilt dirs of all hosts at once."""
+    branch_name = f'update-clang-{build_number}'
+    prebuilt_dirs = [str(paths.CLANG_HOST_PREBUILTS_DIR / host) for host in hosts]
+    utils.unchecked_call(
+        ['repo', 'abandon', branch_name] + prebuilt_dirs,
+        cwd=paths.CLANG_HOST_PREBUILTS_DIR)
+    utils.check_call(
+        ['repo', 'start', branch_name] + prebuilt_dirs,
+        cwd=paths.CLANG_HOST_PREBUILTS_DIR)
+
 
-    if not use_current_branch:
-        branch_name = f'update-clang-{build_number}'
-        utils.unchecked_call(
-            ['repo', 'abandon', branch_name, '.'])
-        utils.check_call(
-            ['repo', 'start', branch_name, '.'])
+def update_clang(host, build_number, download_dir, bug, manifest, overwrite,
+                 do_validity_check, is_testing, executor):
+    prebuilt_dir = paths.CLANG_HOST_PREBUILTS_DIR / host
 
     package = f'{download_dir}/clang-{build_number}-{host}.tar.xz'
 
@@ -217,20 +224,22 @@ def update_clang(host, build_number, use_current_branch, download_dir, bug,
 
     utils.extract_tarball(prebuilt_dir, package)
 
-    extract_subdir = 'clang-' + build_number
-    clang_version_full, clang_version_major, svn_revision = extract_clang_info(extract_subdir)
+    extract_dir = prebuilt_dir / ('clang-' + build_number)
+    clang_version_full, clang_version_major, svn_revision = extract_clang_info(extract_dir)
 
     # Install into clang-<svn_revision>.  Suffixes ('a', 'b', 'c' etc.), if any,
     # are included in the svn_revision.
     install_subdir = 'clang-' + svn_revision
-    install_clang_directory(extract_subdir, install_subdir, overwrite)
+    install_dir = prebuilt_dir / install_subdir
+    removals = [install_clang_directory(extract_dir, install_dir, overwrite,
+                                        executor)]
 
     # Linux prebuilts need to include a few libraries from the linux_musl artifacts
     if host == 'linux-x86':
-        musl_install_subdir = install_subdir + '/musl'
+        musl_install_dir = install_dir / 'musl'
         musl_package = f'{download_dir}/clang-{build_number}-linux_musl-x86.tar.xz'
-        if os.path.exists(extract_subdir):
-            shutil.rmtree(extract_subdir)
+        if os.path.exists(extract_dir):
+            utils.rm_tree(extract_dir)
         utils.extract_tarball(prebuilt_dir, musl_package, [
             "--wildcards",
             "*/lib/libclang.so*",
@@ -241,12 +250,14 @@ def update_clang(host, build_number, use_current_branch, download_dir, bug,
             "*/lib/x86_64-unknown-linux-musl/libc++.a",
             "*/lib/x86_64-unknown-linux-musl/libc++abi.a",
             ])
-        install_clang_directory(extract_subdir, musl_install_subdir, overwrite)
+        removals.append(
+            install_clang_directory(extract_dir, musl_install_dir, overwrite,
+                                    executor))
 
         for triple in ('aarch64-unknown-linux-musl', 'x86_64-unknown-linux-musl'):
             # Move archives.
-            src_dir = Path(musl_install_subdir) / 'lib' / triple
-            dest_dir = Path(install_subdir) / 'lib' / 'clang' / clang_version_major / 'lib' / triple
+            src_dir = musl_install_dir / 'lib' / triple
+            dest_dir = install_dir / 'lib' / 'clang' / clang_version_major / 'lib' / triple
             dest_dir.mkdir(exist_ok=True)  # The x86_64 triple will already exist.
             for name in ('libc++.a', 'libc++abi.a'):
                 shutil.move(src_dir / name, dest_dir / name)
@@ -259,7 +270,7 @@ def update_clang(host, build_number, use_current_branch, download_dir, bug,
             kleaf_versions_lines.insert(list_end_idx, new_version_line)
         with open(paths.KLEAF_VERSIONS_BZL, "w") as f:
             f.write("\n".join(kleaf_versions_lines))
-        utils.check_call(['git', 'add', paths.KLEAF_VERSIONS_BZL])
+        utils.check_call(['git', 'add', paths.KLEAF_VERSIONS_BZL], cwd=prebuilt_dir)
 
     # Some platform tests (e.g. system/bt/profile/sdp) build directly with
     # coverage instrumentation and rely on the driver to pick the correct
@@ -267,19 +278,24 @@ def update_clang(host, build_number, use_current_branch, download_dir, bug,
     # into the Darwin toolchain so the runtime is found by the Darwin Clang
     # driver.
     if host == 'darwin-x86':
-        symlink_to_linux_resource_dir(install_subdir)
+        symlink_to_linux_resource_dir(prebuilt_dir, install_subdir)
 
     if do_validity_check:
-        if not validity_check(host, install_subdir, clang_version_major):
+        if not validity_check(host, install_dir, clang_version_major):
             sys.exit(1)
 
-    shutil.copy(build_info_file, str(prebuilt_dir / install_subdir / 'BUILD_INFO'))
-    shutil.copy(manifest_file, str(prebuilt_dir / install_subdir))
+    shutil.copy(build_info_file, str(install_dir / 'BUILD_INFO'))
+    shutil.copy(manifest_file, str(install_dir))
 
-    utils.check_call(['git', 'add', install_subdir])
+    # Replaced trees must be gone before anything is staged.
+    for removal in removals:
+        if removal:
+            removal.result()
+    utils.check_call(['git', 'add', install_subdir], cwd=prebuilt_dir)
 
     # If there is no difference with the new files, we are already done.
-    diff = utils.unchecked_call(['git', 'diff', '--cached', '--quiet'])
+    diff = utils.unchecked_call(['git', 'diff', '--cached', '--quiet'],
+                                cwd=prebuilt_dir)
     if diff == 0:
         logger().info('Bypassed commit with no diff')
         return
@@ -296,24 +312,42 @@ def update_clang(host, build_number, use_current_branch, download_dir, bug,
         message_lines.append(f'Bug: {format_bug(bug)}')
     message_lines.append('Test: N/A')
     message = '\n'.join(message_lines)
-    utils.check_call(['git', 'commit', '-m', message])
+    utils.check_call(['git', 'commit', '-m', message], cwd=prebuilt_dir)
 
 
-def install_clang_directory(extract_subdir: str, install_subdir: str, overwrite: bool):
-    if os.path.exists(install_subdir):
+def install_clang_directory(
+        extract_dir: Path, install_dir: Path, overwrite: bool,
+        executor: concurrent.futures.Executor) -> Optional[concurrent.futures.Future]:
+    """Moves extract_dir to install_dir.
+
+    The tree previously at install_dir is deleted on executor.  Returns a
+    future for the deletion, or None if there was no such tree.
+    """
+    old_dir = None
+    if os.path.exists(install_dir):
         if overwrite:
             logger().info('Removing/overwriting existing path: %s',
-                          install_subdir)
-            shutil.rmtree(install_subdir)
+                          install_dir)
+            # Move the existing tree aside so it is only deleted once the new
+            # one is in place.
+            old_dir = f'{install_dir}.old'
+            if os.path.exists(old_dir):
+                utils.rm_tree(old_dir)
+            os.rename(install_dir, old_dir)
         else:
             logger().info('Cannot remove/overwrite existing path: %s',
-                          install_subdir)
+                          install_dir)
             sys.exit(1)
-    os.rename(extract_subdir, install_subdir)
+    os.rename(extract_dir, install_dir)
+    if not old_dir:
+        return None
+    # Nothing uses the old tree any more, so delete it while the update
+    # carries on.
+    return executor.submit(utils.rm_tree, old_dir)
 
 
 def update_profiles(download_dir, build_number, bug):
-    profiles_dir = paths.PREBUILTS_DIR / 'clang' / 'host' / 'linux-x86' / 'profiles'
+    profiles_dir = paths.CLANG_HOST_PREBUILTS_DIR / 'linux-x86' / 'profiles'
 
     # First, delete the old profiles.
     for f in glob.glob(f'{profiles_dir}/{PGO_PROFILE_PATTERN}'):
@@ -325,14 +359,14 @@ def update_profiles(download_dir, build_number, bug):
     shutil.copy(glob.glob(f'{download_dir}/{PGO_PROFILE_PATTERN}')[0], str(profiles_dir))
     shutil.copy(glob.glob(f'{download_dir}/{BOLT_PROFILE_PATTERN}')[0], str(profiles_dir))
 
-    utils.check_call(['git', 'add', profiles_dir])
+    utils.check_call(['git', 'add', profiles_dir], cwd=profiles_dir)
     message_lines = [f'Check in profiles from build {build_number}']
     if bug is not None:
         message_lines.append('')
         message_lines.append(f'Bug: {format_bug(bug)}')
     message_lines.append('Test: N/A')
     message = '\n'.join(message_lines)
-    utils.check_call(['git', 'commit', '-m', message])
+    utils.check_call(['git', 'commit', '-m', message], cwd=profiles_dir)
 
 
 def main():
@@ -348,11 +382,9 @@ def main():
     download_dir = os.path.realpath('.download')
     if do_fetch:
         if os.path.isdir(download_dir):
-            shutil.rmtree(download_dir)
+            utils.rm_tree(download_dir)
         os.makedirs(download_dir)
 
-    os.chdir(download_dir)
-
     targets_map = {'darwin-x86': 'darwin_mac',
                    'linux-x86': 'linux',
                    'windows-x86': 'windows_x86_64'}
@@ -379,27 +411,59 @@ def main():
     logger().info('Using branch: %s', branch)
     is_testing = (branch == 'aosp-llvm-toolchain-testing')
 
-    try:
-        if do_fetch:
-            fetch_artifact(branch, targets[0], args.build, manifest)
-            for host in hosts:
-                target = targets_map[host]
-                fetch_artifact(branch, target, args.build, build_info)
-                os.rename(f'{download_dir}/{build_info}', f'{download_dir}/{build_info}-{host}')
-            for target in targets:
-                fetch_artifact(branch, target, args.build, clang_pattern)
+    do_update_profiles = not args.skip_update_profiles and 'linux-x86' in hosts
 
-            if not args.skip_update_profiles and 'linux-x86' in hosts:
-                fetch_artifact(branch, 'linux', args.build, PGO_PROFILE_PATTERN)
-                fetch_artifact(branch, 'linux', args.build, BOLT_PROFILE_PATTERN)
+    # Artifacts needed by each update step.  Every target has a file named
+    # BUILD_INFO, so fetch each one into its own directory.
+    jobs = {'manifest': [(branch, targets[0], args.build, manifest, download_dir)]}
+    for host in hosts:
+        jobs[host] = [(branch, targets_map[host], args.build, build_info,
+                       f'{download_dir}/{host}'),
+                      (branch, targets_map[host], args.build, clang_pattern,
+                       download_dir)]
+    if 'linux-x86' in hosts:
+        jobs['linux-x86'].append((branch, 'linux_musl', args.build, clang_pattern,
+                                  download_dir))
+    if do_update_profiles:
+        jobs['profiles'] = [
+            (branch, 'linux', args.build, PGO_PROFILE_PATTERN, download_dir),
+            (branch, 'linux', args.build, BOLT_PROFILE_PATTERN, download_dir)]
 
-        for host in hosts:
-            update_clang(host, args.build, args.use_current_branch,
-                         download_dir, args.bug, manifest, args.overwrite,
-                         not args.no_validity_check, is_testing)
+    if not args.use_current_branch:
+        start_branches(hosts, args.build)
 
-        if not args.skip_update_profiles and 'linux-x86' in hosts:
-            update_profiles(download_dir, args.build, args.bug)
+    try:
+        # Fetch everything up front and update each host as soon as its
+        # artifacts are in, so extraction overlaps the remaining downloads.
+        # One extra worker deletes replaced toolchains without waiting behind
+        # the downloads.
+        num_jobs = sum(len(step_jobs) for step_jobs in jobs.values()) + 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_jobs) as executor:
+            fetches = {}
+            if do_fetch:
+                for host in hosts:
+                    os.makedirs(f'{download_dir}/{host}')
+                fetches = {step: fetch_artifacts(executor, step_jobs)
+                           for step, step_jobs in jobs.items()}
+
+            def wait_for_fetches(*steps):
+                for step in steps:
+                    for future in fetches.get(step, []):
+                        future.result()
+
+            for host in hosts:
+                wait_for_fetches('manifest', host)
+                if do_fetch:
+                    os.rename(f'{download_dir}/{host}/{build_info}',
+                              f'{download_dir}/{build_info}-{host}')
+                    os.rmdir(f'{download_dir}/{host}')
+                update_clang(host, args.build, download_dir, args.bug, manifest,
+                             args.overwrite, not args.no_validity_check,
+                             is_testing, executor)
+
+            if do_update_profiles:
+                wait_for_fetches('profiles')
+                update_profiles(download_dir, args.build, args.bug)
 
         if args.repo_upload:
             topic = f'clang-prebuilt-{args.build}'
@@ -410,7 +474,7 @@ def main():
                 utils.prebuilt_repo_upload(host, topic, args.hashtag, is_testing)
     finally:
         if do_cleanup:
-            shutil.rmtree(download_dir)
+            utils.rm_tree(download_dir)
 
     return 0
 
@@ -15,17 +15,19 @@
 #
 # pylint: disable=not-callable
 
+import concurrent.futures
 import contextlib
-import datetime
 import logging
 import os
 from pathlib import Path
 import shlex
 import shutil
 import subprocess
-from typing import Dict, List
+import time
+from typing import Dict, List, Tuple
 
 import constants
+import hosts
 import paths
 
 
@@ -36,11 +38,18 @@ def logger():
     return logging.getLogger(__name__)
 
 
+def log_subprocess(cmd, api='subprocess.run') -> None:
+    """Logs that cmd is about to be run through api."""
+    # Quoting the command line is only worth it if the message is emitted.
+    if logger().isEnabledFor(logging.DEBUG):
+        logger().debug('%s:%s %s', api,
+                       time.strftime("%H:%M:%S"),
+                       cmd if isinstance(cmd, str) else list2cmdline(cmd))
+
+
 def subprocess_run(cmd, *args, **kwargs):
     """subprocess.run with logging."""
-    logger().debug('subprocess.run:%s %s',
-                  datetime.datetime.now().strftime("%H:%M:%S"),
-                  cmd if isinstance(cmd, str) else list2cmdline(cmd))
+    log_subprocess(cmd)
     if kwargs.pop('dry_run', None):
         return None
     return subprocess.run(cmd, *args, **kwargs, text=True)
@@ -61,6 +70,31 @@ def check_output(cmd, *args, **kwargs):
     return subprocess_run(cmd, *args, **kwargs, check=True, stdout=subprocess.PIPE).stdout
 
 
+def check_call_parallel(cmds, max_workers=None, **kwargs):
+    """Runs check_call on each command in cmds concurrently.
+
+    Waits for every command to finish.  Each failure is logged, and if any
+    command failed, a RuntimeError listing every failed command is raised.
+    """
+    if max_workers is None:
+        max_workers = min((os.cpu_count() or 1) * 2, 16)
+    cmds = list(cmds)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(check_call, cmd, **kwargs) for cmd in cmds]
+    failures = []
+    for cmd, future in zip(cmds, futures):
+        error = future.exception()
+        if error:
+            cmd_str = cmd if isinstance(cmd, str) else list2cmdline(cmd)
+            logger().error('%s failed: %s', cmd_str, error)
+            failures.append((cmd_str, error))
+    if failures:
+        details = '\n'.join(f'  {cmd_str}: {error}' for cmd_str, error in failures)
+        raise RuntimeError(
+            f'{len(failures)} of {len(cmds)} commands failed:\n{details}'
+        ) from failures[0][1]
+
+
 def create_tarball(source_dir, input, output):
     xz_env = os.environ.copy()
     xz_env["XZ_OPT"] = "-T0"
@@ -77,10 +111,16 @@ def extract_tarball(output_dir, input, args=[]):
     check_call(['tar', '-xC', str(output_dir), '-f', str(input)] + args, env=xz_env)
 
 
+def _parse_version(ver: str) -> Tuple[int, ...]:
+    return tuple(int(v) for v in ver.split('.'))
+
+
+_MAC_MIN_VERSION = _parse_version(constants.MAC_MIN_VERSION)
+
+
 def is_available_mac_ver(ver: str) -> bool:
     """Returns whether a version string is equal to or under MAC_MIN_VERSION."""
-    _parse_version = lambda ver: list(int(v) for v in ver.split('.'))
-    return _parse_version(ver) <= _parse_version(constants.MAC_MIN_VERSION)
+    return _parse_version(ver) <= _MAC_MIN_VERSION
 
 
 def list2cmdline(args: List[str]) -> str:
@@ -106,8 +146,26 @@ def create_script(script_path: Path, cmd: List[str], env: Dict[str, str]) -> Non
     script_path.chmod(0o755)
 
 
+# A successful check guarantees the certificate is valid for another hour, so
+# it can be skipped for half of that.
+_GCERTSTATUS_CACHE_SECONDS = 30 * 60
+
+
 def check_gcertstatus() -> None:
-    """Ensure gcert valid for > 1 hour."""
+    """Ensure gcert valid for > 1 hour.
+
+    A successful check is recorded in $XDG_RUNTIME_DIR and not repeated for
+    the next 30 minutes.
+    """
+    stamp = None
+    if runtime_dir := os.environ.get('XDG_RUNTIME_DIR'):
+        stamp = Path(runtime_dir) / 'llvm_android_gcertstatus'
+        try:
+            if stamp.stat().st_mtime > time.time() - _GCERTSTATUS_CACHE_SECONDS:
+                return
+        except FileNotFoundError:
+            pass
+
     try:
         check_call([
             'gcertstatus', '-quiet', '-check_ssh=false', '-check_remaining=1h'
@@ -116,6 +174,9 @@ def check_gcertstatus() -> None:
         print('Run prodaccess before executing this script.')
         raise
 
+    if stamp:
+        stamp.touch()
+
 
 @contextlib.contextmanager
 def chdir_context(directory):
@@ -129,7 +190,7 @@ def chdir_context(directory):
 
 def prebuilt_repo_upload(host: str, topic: str, hashtag: str, is_testing: bool):
     """ Upload CL in a prebuilt clang dir. """
-    prebuilt_dir = paths.PREBUILTS_DIR / 'clang' / 'host' / host
+    prebuilt_dir = paths.CLANG_HOST_PREBUILTS_DIR / host
     if hashtag:
         hashtag = hashtag + ',' + topic
     else:
@@ -147,6 +208,28 @@ def prebuilt_repo_upload(host: str, topic: str, hashtag: str, is_testing: bool):
     check_output(cmd, cwd=prebuilt_dir)
 
 
+def rm_tree(path) -> None:
+    """Recursively deletes a directory tree.
+
+    Uses a single `rm -rf` outside of Windows, which is considerably faster
+    than shutil.rmtree on trees the size of a clang prebuilt. Empty
+    directories are removed with a single rmdir instead.
+
+    Like shutil.rmtree, raises FileNotFoundError if path does not exist.
+    """
+    try:
+        os.rmdir(path)
+        return
+    except FileNotFoundError:
+        raise
+    except OSError:
+        pass
+    if hosts.build_host().is_windows:
+        shutil.rmtree(path)
+    else:
+        check_call(['rm', '-rf', '--', str(path)])
+
+
 def clean_out_dir():
     """Delete files from older build (paths.OUT_DIR) but retain paths.OUT_DIR /
     prebuilt_cached, which is input for a chained build.
@@ -156,6 +239,6 @@ def clean_out_dir():
         if child.name == 'prebuilt_cached':
             continue
         if child.is_dir():
-            shutil.rmtree(child)
+            rm_tree(child)
         else:
             child.unlink()